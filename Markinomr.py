@@ -1,59 +1,557 @@
 import cv2
 import numpy as np
-import pandas as pd
 import os
+import sys
+import csv
+
+IMAGE_EXTENSIONS = ('.jpg', '.png', '.jpeg')
+MULTIPAGE_EXTENSIONS = ('.tif', '.tiff', '.pdf')
+PDF_RENDER_DPI = 200  # Fallback for PDF pages that hold no embedded scan
+TIFF_CHUNK_PAGES = 4  # Pages per cv2.imreadmulti call when Pillow is not installed
+BUBBLE_RADIUS = 10  # Half the side of the square window sampled around each bubble
+FILL_THRESHOLD = 5  # Fill % above which a bubble counts as marked
+REVIEW_MARGIN = 3  # Fills within this many points of the threshold are ambiguous
+REVIEW_CONFIDENCE = 0.9  # Sheets below this confidence go to the review queue
+MEMORY_REPORT_EVERY = 1000  # Pages between peak memory reports in batch mode
+EXCEL_MAX_ROWS = 1048576  # Rows per worksheet, header included
+REPORT_COLUMNS = ["Image", "Page", "Question", "Option", "Fill %", "Status", "Duplicate Mark", "Duplicate Fill %"]
 
 def load_excel(file_path):
+    import pandas as pd  # Only Excel templates need pandas
     return pd.read_excel(file_path)
 
-def process_omr(image_dir, coordinates_file):
-    coordinates = load_excel(coordinates_file)
-    results = []
-    output_file = os.path.join(image_dir, "OMR_Report.xlsx")
-    
-    for image_name in os.listdir(image_dir):
-        if not image_name.lower().endswith(('.jpg', '.png', '.jpeg')):
-            continue
-        
-        image_path = os.path.join(image_dir, image_name)
+def _pdf_page_dpi(page):
+    # Resolution of the largest embedded scan, so the page renders on the scan's own
+    # pixel grid and template coordinates marked on full-resolution images still fit
+    best = None
+    for item in page.get_images(full=True):
+        width, bbox = item[2], page.get_image_bbox(item)
+        if bbox.width > 0 and (best is None or width > best[0]):
+            best = (width, width * 72 / bbox.width)
+    return best[1] if best else PDF_RENDER_DPI
+
+def _pdf_page_to_image(page, flags, dpi=None):
+    # Render a single PDF page straight into a numpy array, no temporary files
+    import fitz
+    colorspace = fitz.csGRAY if flags == cv2.IMREAD_GRAYSCALE else fitz.csRGB
+    zoom = (dpi or _pdf_page_dpi(page)) / 72
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=colorspace, alpha=False)
+    image = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)
+    image = image[:, :pix.width * pix.n].reshape(pix.height, pix.width, pix.n)
+    if pix.n == 1:
+        return image[:, :, 0].copy()
+    return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+def _iter_pdf_pages(image_path, flags, dpi=None):
+    try:
+        import fitz  # PyMuPDF, only needed for PDF batches
+    except ImportError:
+        print(f"PyMuPDF is required to read PDF files, skipping: {image_path}")
+        return
+    try:
+        document = fitz.open(image_path)
+    except Exception as error:
+        print(f"Failed to load image: {image_path} ({error})")
+        return
+    with document:
+        if document.needs_pass:
+            print(f"Failed to load image: {image_path} (PDF is encrypted)")
+            return
+        for index in range(document.page_count):
+            # A page that fails to render is reported by the caller like any unreadable image
+            try:
+                image = _pdf_page_to_image(document[index], flags, dpi)
+            except Exception:
+                image = None
+            yield index + 1, image
+
+def _pil_to_image(frame, flags):
+    if flags == cv2.IMREAD_GRAYSCALE:
+        return np.asarray(frame.convert("L"))
+    return cv2.cvtColor(np.asarray(frame.convert("RGB")), cv2.COLOR_RGB2BGR)
+
+def _iter_tiff_pages(image_path, flags):
+    try:
+        from PIL import Image  # Pillow walks the page chain once, front to back
+    except ImportError:
+        yield from _iter_tiff_pages_cv2(image_path, flags)
+        return
+    try:
+        container = Image.open(image_path)
+    except Exception as error:
+        print(f"Failed to load image: {image_path} ({error})")
+        return
+    with container:
+        page = 0
+        while True:
+            try:
+                container.seek(page)
+            except EOFError:
+                return
+            except Exception as error:
+                # A broken page chain leaves no way to reach the pages after it
+                print(f"Failed to read {image_path} past page {page} ({error})")
+                return
+            try:
+                image = _pil_to_image(container, flags)
+            except Exception:
+                image = None
+            page += 1
+            yield page, image
+
+def _iter_tiff_pages_cv2(image_path, flags):
+    # cv2.imreadmulti reopens the file and walks to `start` on every call, so read
+    # a few pages per call to keep that cost down while memory stays bounded
+    try:
+        total = cv2.imcount(image_path)
+    except cv2.error as error:
+        print(f"Failed to load image: {image_path} ({error})")
+        return
+    for start in range(0, total, TIFF_CHUNK_PAGES):
+        count = min(TIFF_CHUNK_PAGES, total - start)
+        try:
+            ok, pages = cv2.imreadmulti(image_path, start, count, flags=flags)
+        except cv2.error:
+            ok, pages = False, []
+        if not ok or len(pages) != count:
+            pages = [None] * count
+        for index, image in enumerate(pages):
+            yield start + index + 1, image
+
+def read_page(image_path, page=1, flags=cv2.IMREAD_GRAYSCALE, pdf_dpi=None):
+    """Load a single page (1-based) from an image, multi-page TIFF or PDF file.
+
+    Meant for random access such as the review GUI; use iter_pages to read a
+    whole container. PDF pages render at the resolution of their embedded scan
+    unless pdf_dpi is given. Returns None for a page the file does not have.
+    """
+    if page < 1:
+        return None
+    extension = os.path.splitext(image_path)[1].lower()
+    if extension == '.pdf':
+        import fitz
+        with fitz.open(image_path) as document:
+            if page > document.page_count:
+                return None
+            return _pdf_page_to_image(document[page - 1], flags, pdf_dpi)
+    if extension in ('.tif', '.tiff'):
+        ok, pages = cv2.imreadmulti(image_path, page - 1, 1, flags=flags)
+        return pages[0] if ok and pages else None
+    return cv2.imread(image_path, flags) if page == 1 else None
+
+class PageBuffers:
+    """Decode and threshold buffers reused for every page a batch worker scores.
+
+    The buffers are sized from the first page and only reallocated when a page
+    with different dimensions comes along, so a run over sheets printed from one
+    template keeps a constant footprint.
+    """
+
+    def __init__(self):
+        self.gray = None
+        self.binary = None
+        self.reallocations = 0
+        self.in_place = True  # Cleared when this OpenCV build cannot imread into a buffer
+
+    def _allocate(self, shape):
+        self.gray = np.empty(shape, dtype=np.uint8)
+        self.binary = np.empty(shape, dtype=np.uint8)
+        self.reallocations += 1
+
+    def decode(self, image_path):
+        if not cv2.haveImageReader(image_path):
+            return None
+        if self.gray is not None and self.in_place:
+            # A failed in-place decode hands back the untouched buffer, so start from a
+            # white page and confirm anything still all white with an allocating decode.
+            self.gray.fill(255)
+            try:
+                image = cv2.imread(image_path, self.gray, cv2.IMREAD_GRAYSCALE)
+                if image is not None and image.min() < 255:
+                    return image
+            except cv2.error as error:
+                if "Overload resolution failed" in str(error):
+                    self.in_place = False  # This OpenCV build cannot imread into a buffer
+                # Otherwise the page size differs from the buffers
         image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-        if image is None:
-            print(f"Failed to load image: {image_path}")
+        if image is not None and (self.gray is None or self.gray.shape != image.shape):
+            self._allocate(image.shape)
+        return image
+
+    def threshold(self, image):
+        if self.binary is None or self.binary.shape != image.shape:
+            self._allocate(image.shape)
+        return threshold_page(image, self.binary)
+
+def peak_memory_mb():
+    """Peak resident memory of this process in MB, or None where it cannot be read."""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil  # Windows has no resource module
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2**20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+def _format_peak_memory():
+    peak = peak_memory_mb()
+    return "n/a" if peak is None else f"{peak:.1f} MB"
+
+def iter_pages(image_path, flags=cv2.IMREAD_GRAYSCALE, buffers=None, pdf_dpi=None):
+    """Yield (page_number, image) for every page of a file, decoding one page at a time.
+
+    Multi-page TIFF and PDF batches are never loaded whole, so memory stays bounded
+    by a single page regardless of how many pages the container holds. With
+    PageBuffers, single-page images are decoded into the reused grayscale buffer.
+    """
+    extension = os.path.splitext(image_path)[1].lower()
+    if extension == '.pdf':
+        yield from _iter_pdf_pages(image_path, flags, pdf_dpi)
+    elif extension in ('.tif', '.tiff'):
+        yield from _iter_tiff_pages(image_path, flags)
+    elif buffers is not None and flags == cv2.IMREAD_GRAYSCALE:
+        yield 1, buffers.decode(image_path)
+    else:
+        yield 1, cv2.imread(image_path, flags)
+
+def compile_template(records):
+    """Compile flat Question/Option/X/Y rows into lattice blocks.
+
+    Consecutive questions of the same group that lay their options out on one
+    line at the same x positions are merged into a single block described by
+    its column xs and row ys. Bubbles that do not fit a lattice (for example
+    options stacked vertically) become 1x1 blocks.
+    """
+    questions = []
+    for record in records:
+        key = (record.get('Group'), record['Question'])
+        if not questions or questions[-1][0] != key:
+            questions.append((key, record['Question'], []))
+        questions[-1][2].append((record['Option'], int(float(record['X'])), int(float(record['Y']))))
+
+    blocks = []
+    for (group, _), question, bubbles in questions:
+        options = [bubble[0] for bubble in bubbles]
+        xs = [bubble[1] for bubble in bubbles]
+        ys = set(bubble[2] for bubble in bubbles)
+        if len(ys) != 1:
+            for option, x, y in bubbles:
+                blocks.append({"group": group, "questions": [question], "options": [option], "xs": [x], "ys": [y]})
             continue
-        
-        threshold_img = cv2.threshold(image, 150, 255, cv2.THRESH_BINARY_INV)[1]
-        image_results = []
-        question_marks = {}
-        
-        for _, row in coordinates.iterrows():
-            question, option, x, y = row['Question'], row['Option'], int(row['X']), int(row['Y'])
-            region = threshold_img[max(0, y-10):y+10, max(0, x-10):x+10]
-            
-            if region.size == 0:
-                print(f"Invalid region for question {question}, option {option} in {image_name}")
+        last = blocks[-1] if blocks else None
+        if last and last["group"] == group and last["options"] == options and last["xs"] == xs:
+            last["questions"].append(question)
+            last["ys"].append(ys.pop())
+        else:
+            blocks.append({"group": group, "questions": [question], "options": options, "xs": xs, "ys": [ys.pop()]})
+
+    for block in blocks:
+        block["xs"] = np.array(block["xs"], dtype=np.intp)
+        block["ys"] = np.array(block["ys"], dtype=np.intp)
+    return blocks
+
+def expand_grid(records):
+    """Build lattice blocks from parametric Group/FirstQuestion/FirstOption/X/Y/XStep/YStep/Rows/Columns rows."""
+    blocks = []
+    for record in records:
+        rows, columns = int(record['Rows']), int(record['Columns'])
+        x, y = float(record['X']), float(record['Y'])
+        x_step, y_step = float(record['XStep']), float(record['YStep'])
+        first_question, first_option = int(record['FirstQuestion']), ord(str(record['FirstOption']))
+        blocks.append({
+            "group": record.get('Group'),
+            "questions": [first_question + q for q in range(rows)],
+            "options": [chr(first_option + opt) for opt in range(columns)],
+            # Same rounding as the GUI uses when it lays the bubbles out
+            "xs": np.array([int(x + opt * x_step) for opt in range(columns)], dtype=np.intp),
+            "ys": np.array([int(y + q * y_step) for q in range(rows)], dtype=np.intp),
+        })
+    return blocks
+
+def load_template(file_path):
+    """Load a flat coordinates file or a parametric grid file as a list of lattice blocks."""
+    if file_path.lower().endswith('.csv'):
+        with open(file_path, newline="") as f:
+            reader = csv.DictReader(f)
+            columns, records = reader.fieldnames, list(reader)
+    else:
+        table = load_excel(file_path)
+        columns, records = list(table.columns), table.to_dict('records')
+    if 'Rows' in columns:
+        return expand_grid(records)
+    return compile_template(records)
+
+def _grid_axis(values):
+    # Origin and step that reproduce values with the GUI's int() rounding, else None.
+    # int(origin + i * step) == values[i] bounds step to [(v - origin) / i, (v + 1 - origin) / i)
+    # for every i; any step inside all of those intervals reproduces the axis.
+    origin = int(values[0])
+    if len(values) == 1:
+        return origin, 0
+    low = max((value - origin) / i for i, value in enumerate(values) if i)
+    high = min((value + 1 - origin) / i for i, value in enumerate(values) if i)
+    for candidate in (round(low), low, (low + high) / 2):
+        if all(int(origin + i * candidate) == value for i, value in enumerate(values)):
+            return origin, candidate
+    return None
+
+def _grid_question(question):
+    # Grid rows number questions as FirstQuestion + row, so labels must be whole numbers
+    try:
+        number = float(question)
+    except (TypeError, ValueError):
+        return None
+    return int(number) if number.is_integer() else None
+
+def save_grid(template, output_file):
+    """Write lattice blocks as a parametric grid file readable by load_template.
+
+    Blocks whose questions and options run consecutively and whose positions follow
+    a single step become one row; anything else is written bubble by bubble. The
+    grid format needs integer question numbers and single-letter options, so a
+    template with other labels raises ValueError before anything is written.
+    """
+    for block in template:
+        for question in block["questions"]:
+            if _grid_question(question) is None:
+                raise ValueError(f"Grid templates need integer question numbers, found question {question!r}")
+        for option in block["options"]:
+            if not isinstance(option, str) or len(option) != 1:
+                raise ValueError(f"Grid templates need single-letter options, found option {option!r}")
+
+    with open(output_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Group", "FirstQuestion", "FirstOption", "X", "Y", "XStep", "YStep", "Rows", "Columns"])
+        for block in template:
+            group, questions, options = block["group"], [_grid_question(q) for q in block["questions"]], block["options"]
+            x_axis, y_axis = _grid_axis(block["xs"].tolist()), _grid_axis(block["ys"].tolist())
+            consecutive = (
+                all(q == questions[0] + i for i, q in enumerate(questions))
+                and all(ord(o) == ord(options[0]) + i for i, o in enumerate(options))
+            )
+            if consecutive and x_axis and y_axis:
+                writer.writerow([group, questions[0], options[0], x_axis[0], y_axis[0], x_axis[1], y_axis[1], len(questions), len(options)])
+                continue
+            for question, y in zip(questions, block["ys"].tolist()):
+                for option, x in zip(options, block["xs"].tolist()):
+                    writer.writerow([group, question, option, x, y, 0, 0, 1, 1])
+    print(f"Template saved to {output_file}")
+
+def _uniform_step(values):
+    # Integer pitch of an evenly spaced axis that leaves bubble windows non-overlapping, else None
+    if len(values) == 1:
+        return 2 * BUBBLE_RADIUS
+    steps = np.diff(values)
+    if (steps == steps[0]).all() and steps[0] >= 2 * BUBBLE_RADIUS:
+        return int(steps[0])
+    return None
+
+def block_fills(threshold_img, xs, ys):
+    """Return the fill % of every bubble in a block as a (len(ys), len(xs)) array.
+
+    threshold_img may also be an (N, height, width) stack of same-sized pages, in
+    which case an (N, len(ys), len(xs)) array comes back and the whole stack is
+    reduced in the same pass. Blocks that sit fully inside the page are reduced
+    in one pass: evenly spaced blocks through a strided view of the page, others
+    through a single gather of their rows and columns. Blocks touching the border
+    fall back to clipped per-bubble windows; empty windows are reported as NaN.
+    """
+    pages = threshold_img[None] if threshold_img.ndim == 2 else threshold_img
+    r = BUBBLE_RADIUS
+    count, height, width = pages.shape
+    if ys.min() - r >= 0 and ys.max() + r <= height and xs.min() - r >= 0 and xs.max() + r <= width:
+        y_step, x_step = _uniform_step(ys), _uniform_step(xs)
+        if y_step and x_step:
+            origin = pages[:, ys[0] - r:, xs[0] - r:]
+            page_stride, row_stride, col_stride = origin.strides
+            windows = np.lib.stride_tricks.as_strided(
+                origin, shape=(count, len(ys), 2 * r, len(xs), 2 * r),
+                strides=(page_stride, y_step * row_stride, row_stride, x_step * col_stride, col_stride), writeable=False)
+        else:
+            offsets = np.arange(-r, r)
+            rows = (ys[:, None] + offsets).ravel()
+            cols = (xs[:, None] + offsets).ravel()
+            windows = pages[:, rows][:, :, cols].reshape(count, len(ys), 2 * r, len(xs), 2 * r)
+        # Summing the 0/255 pixels avoids a boolean copy of every bubble window
+        fills = windows.sum(axis=(2, 4), dtype=np.int32) * (100 / 255 / (2 * r) ** 2)
+    else:
+        fills = np.full((count, len(ys), len(xs)), np.nan)
+        for i, y in enumerate(ys):
+            for j, x in enumerate(xs):
+                region = pages[:, max(0, y-r):y+r, max(0, x-r):x+r]
+                if region[0].size:
+                    fills[:, i, j] = np.count_nonzero(region, axis=(1, 2)) / region[0].size * 100
+    return fills[0] if threshold_img.ndim == 2 else fills
+
+def page_results(template, fills, image_name, page=1):
+    """Build the report rows of one page from the per-block fills of block_fills."""
+    image_results = []
+    question_marks = {}
+    
+    for block, block_fill in zip(template, fills):
+        for question, question_fills in zip(block["questions"], block_fill):
+            for option, fill_percentage in zip(block["options"], question_fills.tolist()):
+                if np.isnan(fill_percentage):
+                    print(f"Invalid region for question {question}, option {option} in {image_name} (page {page})")
+                    continue
+                
+                marked_status = "Marked" if fill_percentage > FILL_THRESHOLD else "Unmarked"
+                
+                if marked_status == "Marked":
+                    if question not in question_marks:
+                        question_marks[question] = []
+                    question_marks[question].append((option, fill_percentage))
+                
+                image_results.append([image_name, page, question, option, fill_percentage, marked_status, "No", "0%"])
+    
+    for row in image_results:
+        image_name, page, question, option, fill_percentage, marked_status, _, _ = row
+        if question in question_marks and len(question_marks[question]) > 1:
+            row[6] = "Duplicate"
+            row[7] = f"{max(opt[1] for opt in question_marks[question]):.2f}%"
+    
+    return image_results
+
+def threshold_page(image, dst=None):
+    """Binarise a grayscale page so that marks are 255, optionally into dst."""
+    return cv2.threshold(image, 150, 255, cv2.THRESH_BINARY_INV, dst=dst)[1]
+
+def score_page(image, template, image_name, page=1, buffers=None):
+    threshold_img = buffers.threshold(image) if buffers is not None else threshold_page(image)
+    fills = [block_fills(threshold_img, block["xs"], block["ys"]) for block in template]
+    return page_results(template, fills, image_name, page)
+
+def score_pages(threshold_stack, template, pages):
+    """Score an (N, height, width) stack of thresholded pages in one pass per block.
+
+    pages holds the (image_name, page) of each stacked sheet; one list of report
+    rows is returned per sheet, as score_page would give.
+    """
+    fills = [block_fills(threshold_stack, block["xs"], block["ys"]) for block in template]
+    return [page_results(template, [block_fill[i] for block_fill in fills], image_name, page)
+            for i, (image_name, page) in enumerate(pages)]
+
+def sheet_confidence(image_results):
+    """Score how much a sheet can be trusted, returning (confidence, reasons).
+
+    Every question that has an option filled close to the threshold, more than one
+    mark or no mark at all counts against the sheet.
+    """
+    questions = {}
+    for _, _, question, _, fill_percentage, marked_status, duplicate, _ in image_results:
+        flags = questions.setdefault(question, {"ambiguous": False, "marked": False, "duplicate": False})
+        flags["ambiguous"] |= abs(fill_percentage - FILL_THRESHOLD) <= REVIEW_MARGIN
+        flags["marked"] |= marked_status == "Marked"
+        flags["duplicate"] |= duplicate == "Duplicate"
+    if not questions:
+        return 0.0, "no bubbles scored"
+
+    ambiguous = sum(flags["ambiguous"] for flags in questions.values())
+    duplicates = sum(flags["duplicate"] for flags in questions.values())
+    blanks = sum(not flags["marked"] for flags in questions.values())
+    flagged = sum(flags["ambiguous"] or flags["duplicate"] or not flags["marked"] for flags in questions.values())
+    reasons = [f"{count} {label}" for count, label in ((ambiguous, "near threshold"), (duplicates, "duplicate"), (blanks, "blank")) if count]
+    return 1 - flagged / len(questions), ", ".join(reasons)
+
+class ReportWriter:
+    """Stream report rows to a CSV or Excel file as pages are scored.
+
+    Rows are never collected in memory, so a run of any length keeps a flat
+    footprint. Excel reports go through openpyxl's write-only mode and continue
+    on a new worksheet before a sheet reaches Excel's row limit.
+    """
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.excel = output_file.lower().endswith('.xlsx')
+
+    def __enter__(self):
+        if self.excel:
+            from openpyxl import Workbook
+            self.workbook = Workbook(write_only=True)
+            self.sheets = 0
+            self._new_sheet()
+        else:
+            self.file = open(self.output_file, "w", newline="")
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(REPORT_COLUMNS)
+        return self
+
+    def _new_sheet(self):
+        self.sheets += 1
+        self.sheet = self.workbook.create_sheet("Report" if self.sheets == 1 else f"Report {self.sheets}")
+        self.sheet.append(REPORT_COLUMNS)
+        self.sheet_rows = 1
+
+    def write_rows(self, rows):
+        if not self.excel:
+            self.writer.writerows(rows)
+            return
+        for row in rows:
+            if self.sheet_rows == EXCEL_MAX_ROWS:
+                self._new_sheet()
+            self.sheet.append(row)
+            self.sheet_rows += 1
+
+    def __exit__(self, *exc_info):
+        if self.excel:
+            self.workbook.save(self.output_file)
+        else:
+            self.file.close()
+
+def save_review_queue(review_queue, output_file):
+    # Least confident sheets first so reviewers see the worst ones up front
+    review_queue.sort(key=lambda entry: entry[2])
+    with open(output_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Image", "Page", "Confidence", "Reasons"])
+        for image_name, page, confidence, reasons in review_queue:
+            writer.writerow([image_name, page, f"{confidence:.3f}", reasons])
+    print(f"{len(review_queue)} sheets queued for review in {output_file}")
+
+def process_omr(image_dir, coordinates_file, batch_mode=False, pdf_dpi=None):
+    """Score every sheet in image_dir and write the report next to the images.
+
+    Report rows are streamed to OMR_Report.xlsx as each page is scored. In batch
+    mode pages are decoded and thresholded into reused PageBuffers and the report
+    is OMR_Report.csv, so memory stays flat however many sheets the run covers.
+    Peak memory is printed every MEMORY_REPORT_EVERY pages and at the end. PDF
+    pages render at their embedded scan's resolution unless pdf_dpi overrides it.
+    """
+    template = load_template(coordinates_file)
+    review_queue = []
+    output_file = os.path.join(image_dir, "OMR_Report.csv" if batch_mode else "OMR_Report.xlsx")
+    review_file = os.path.join(image_dir, "Review_Queue.csv")
+    buffers = PageBuffers() if batch_mode else None
+    pages_scored = 0
+    
+    with ReportWriter(output_file) as report:
+        for image_name in os.listdir(image_dir):
+            if not image_name.lower().endswith(IMAGE_EXTENSIONS + MULTIPAGE_EXTENSIONS):
                 continue
             
-            fill_percentage = np.sum(region == 255) / region.size * 100
-            marked_status = "Marked" if fill_percentage > 5 else "Unmarked"
-            
-            if marked_status == "Marked":
-                if question not in question_marks:
-                    question_marks[question] = []
-                question_marks[question].append((option, fill_percentage))
-            
-            image_results.append([image_name, question, option, fill_percentage, marked_status, "No", "0%"])
-        
-        for row in image_results:
-            image_name, question, option, fill_percentage, marked_status, _, _ = row
-            if question in question_marks and len(question_marks[question]) > 1:
-                row[5] = "Duplicate"
-                row[6] = f"{max(opt[1] for opt in question_marks[question]):.2f}%"
-        
-        results.extend(image_results)
+            image_path = os.path.join(image_dir, image_name)
+            for page, image in iter_pages(image_path, buffers=buffers, pdf_dpi=pdf_dpi):
+                if image is None:
+                    print(f"Failed to load page {page} of image: {image_path}")
+                    continue
+                image_results = score_page(image, template, image_name, page, buffers)
+                confidence, reasons = sheet_confidence(image_results)
+                if confidence < REVIEW_CONFIDENCE:
+                    review_queue.append((image_name, page, confidence, reasons))
+                report.write_rows(image_results)
+                
+                pages_scored += 1
+                if batch_mode and pages_scored % MEMORY_REPORT_EVERY == 0:
+                    print(f"Scored {pages_scored} pages, peak memory {_format_peak_memory()}")
     
-    df = pd.DataFrame(results, columns=["Image", "Question", "Option", "Fill %", "Status", "Duplicate Mark", "Duplicate Fill %"])
-    df.to_excel(output_file, index=False)
+    if batch_mode:
+        print(f"Scored {pages_scored} pages, peak memory {_format_peak_memory()}, buffer allocations {buffers.reallocations}")
     print(f"Results saved to {output_file}")
+    save_review_queue(review_queue, review_file)
 
 if __name__ == "__main__":
     image_directory = r"C:\Users\NIPUN\Desktop\18.03.2025\Images\01\0101" # Specify the directory containing images
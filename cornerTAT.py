@@ -31,7 +31,8 @@ def detect_tat_ids(image_path, output_path):
     cv2.imwrite(output_path, image)
     print(f"Processed image saved to {output_path}")
 
-# Example usage
-image_path = "200784.jpg"  # Replace with your input file path
-output_path = "output_tat_ids.jpg"  # Replace with your desired output file path
-detect_tat_ids(image_path, output_path)
\ No newline at end of file
+if __name__ == "__main__":
+    # Example usage
+    image_path = "200784.jpg"  # Replace with your input file path
+    output_path = "output_tat_ids.jpg"  # Replace with your desired output file path
+    detect_tat_ids(image_path, output_path)
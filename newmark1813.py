@@ -1,9 +1,65 @@
 import sys
+import os
+import csv
 import cv2
 import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from PyQt5.QtWidgets import QApplication, QLabel, QMainWindow, QFileDialog, QVBoxLayout, QWidget, QScrollArea, QTextEdit, QMenuBar, QAction, QInputDialog, QTableWidget, QTableWidgetItem, QMessageBox, QSplitter, QMenu, QStatusBar, QPushButton
 from PyQt5.QtGui import QPixmap, QImage
 from PyQt5.QtCore import Qt
+from Markinomr import compile_template, read_page, save_grid
+
+class SheetCache:
+    """LRU cache of decoded sheets that prefetches upcoming pages on a worker thread.
+
+    Every page is decoded on the single worker, including cache misses, because
+    PyMuPDF must not render PDF pages from several threads at once.
+    """
+
+    def __init__(self, capacity=8):
+        self.capacity = capacity
+        self.sheets = OrderedDict()  # (path, page) -> decoded BGR image
+        self.pending = {}  # (path, page) -> Future for a prefetch in flight
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def _store(self, key, image):
+        self.sheets[key] = image
+        self.sheets.move_to_end(key)
+        while len(self.sheets) > self.capacity:
+            self.sheets.popitem(last=False)
+
+    def get(self, path, page):
+        key = (path, page)
+        if key in self.sheets:
+            self.sheets.move_to_end(key)
+            return self.sheets[key]
+        future = self.pending.pop(key, None)
+        try:
+            if future is None:
+                future = self.executor.submit(read_page, path, page, cv2.IMREAD_COLOR)
+            image = future.result()
+        except Exception as error:
+            # An unhandled exception in a Qt slot aborts the app, so a moved or corrupt
+            # sheet is reported as a failed load instead
+            print(f"Failed to load page {page} of {path}: {error}")
+            return None
+        if image is not None:
+            self._store(key, image)
+        return image
+
+    def prefetch(self, keys):
+        # Drop prefetches that are no longer in the look-ahead window
+        for key in list(self.pending):
+            if key not in keys:
+                self.pending.pop(key).cancel()
+        for path, page in keys:
+            key = (path, page)
+            if key not in self.sheets and key not in self.pending:
+                self.pending[key] = self.executor.submit(read_page, path, page, cv2.IMREAD_COLOR)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
 class OMRScanner(QMainWindow):
     def __init__(self):
@@ -29,6 +85,10 @@ class OMRScanner(QMainWindow):
         load_image_action.triggered.connect(self.load_image)
         self.file_menu.addAction(load_image_action)
 
+        load_review_queue_action = QAction("Open Review Queue", self)
+        load_review_queue_action.triggered.connect(self.load_review_queue)
+        self.file_menu.addAction(load_review_queue_action)
+
         export_coordinates_action = QAction("Export Coordinates", self)
         export_coordinates_action.triggered.connect(self.export_coordinates)
         self.file_menu.addAction(export_coordinates_action)
@@ -82,6 +142,15 @@ class OMRScanner(QMainWindow):
         self.tools_menu.addAction(zoom_out_action)
         self.toolbar.addAction(zoom_out_action)  # Add to Toolbar
 
+        # Add review queue navigation to the toolbar
+        previous_sheet_action = QAction("Previous Sheet", self)
+        previous_sheet_action.triggered.connect(self.previous_sheet)
+        self.toolbar.addAction(previous_sheet_action)
+
+        next_sheet_action = QAction("Next Sheet", self)
+        next_sheet_action.triggered.connect(self.next_sheet)
+        self.toolbar.addAction(next_sheet_action)
+
         # Add status bar with delete button aligned to the right
         self.status_bar = QStatusBar()
         self.setStatusBar(self.status_bar)
@@ -136,6 +205,12 @@ class OMRScanner(QMainWindow):
         self.marking_enabled = False
         self.zoom_factor = 1.0
 
+        # Review queue of low-confidence sheets produced by the batch scorer
+        self.review_queue = []  # List of (image path, page, confidence, reasons)
+        self.review_index = -1
+        self.prefetch_count = 3  # Number of upcoming sheets decoded in the background
+        self.sheet_cache = SheetCache()
+
         self.image_label.setMouseTracking(True)
         self.image_label.mouseMoveEvent = self.show_cursor_position
         self.image_label.mousePressEvent = self.mark_point
@@ -147,6 +222,46 @@ class OMRScanner(QMainWindow):
             self.display_image = self.image.copy()
             self.update_display()
 
+    def load_review_queue(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, "Open Review Queue", "", "CSV Files (*.csv)")
+        if not file_path:
+            return
+        # Image names in the queue are relative to the folder the scorer wrote it to
+        image_dir = os.path.dirname(file_path)
+        with open(file_path, newline="") as f:
+            self.review_queue = [(os.path.join(image_dir, row["Image"]), int(row["Page"]), float(row["Confidence"]), row["Reasons"]) for row in csv.DictReader(f)]
+        if not self.review_queue:
+            QMessageBox.information(self, "Review Queue", "No sheets need review.")
+            return
+        self.show_sheet(0)
+
+    def show_sheet(self, index):
+        """Display the review queue entry at index and prefetch the sheets after it."""
+        if not 0 <= index < len(self.review_queue):
+            return
+        self.review_index = index
+        path, page, confidence, reasons = self.review_queue[index]
+        image = self.sheet_cache.get(path, page)
+        upcoming = self.review_queue[index + 1:index + 1 + self.prefetch_count]
+        self.sheet_cache.prefetch([(entry[0], entry[1]) for entry in upcoming])
+        if image is None:
+            QMessageBox.warning(self, "Load Failed", f"Could not load page {page} of {path}.")
+            return
+        self.image = image
+        self.display_image = self.image.copy()
+        self.update_display()
+        self.status_bar.showMessage(f"Sheet {index + 1}/{len(self.review_queue)}: {os.path.basename(path)} page {page}, confidence {confidence:.2f} ({reasons})")
+
+    def next_sheet(self):
+        self.show_sheet(self.review_index + 1)
+
+    def previous_sheet(self):
+        self.show_sheet(self.review_index - 1)
+
+    def closeEvent(self, event):
+        self.sheet_cache.shutdown()
+        super().closeEvent(event)
+
     def update_display(self):
         if self.display_image is not None:
             # Scale the image for display based on the zoom factor
@@ -410,6 +525,15 @@ class OMRScanner(QMainWindow):
                 for group_name, coords in self.groups.items():
                     for coord in coords:
                         f.write(f"{group_name},{coord[0]},{coord[1]},{coord[2]},{coord[3]}\n")
+
+            # Alongside the flat file, write each group as lattice blocks so the scorer can read it
+            # block by block; built from self.groups so it always matches the flat file
+            records = [{"Group": group_name, "Question": coord[0], "Option": coord[1], "X": coord[2], "Y": coord[3]}
+                       for group_name, coords in self.groups.items() for coord in coords]
+            try:
+                save_grid(compile_template(records), os.path.splitext(file_path)[0] + "_grid.csv")
+            except ValueError as error:
+                QMessageBox.warning(self, "Grid Not Exported", str(error))
             QMessageBox.information(self, "Export Successful", "Coordinates exported successfully.")
 
     def update_group_menu(self):
@@ -0,0 +1,88 @@
+import argparse
+import sys
+
+# Heavy modules (cv2, numpy, pandas, PyQt5) are imported inside each command so
+# that `omr.py <command> --help` and short scripted runs only pay for what they use.
+
+def score(args):
+    from Markinomr import process_omr
+    process_omr(args.image_dir, args.template, batch_mode=not args.excel, pdf_dpi=args.pdf_dpi)
+
+def detect_markers(args):
+    from cornerTAT import detect_tat_ids
+    detect_tat_ids(args.image, args.output)
+
+def compile_template(args):
+    from Markinomr import load_template, save_grid
+    try:
+        save_grid(load_template(args.coordinates), args.output)
+    except ValueError as error:
+        sys.exit(f"compile-template: {error}")
+
+def gui(args):
+    from PyQt5.QtWidgets import QApplication
+    from newmark1813 import OMRScanner
+    app = QApplication(sys.argv[:1])
+    window = OMRScanner()
+    window.show()
+    return app.exec_()
+
+def serve(args):
+    import asyncio
+    from omrserver import serve as run_server
+    try:
+        asyncio.run(run_server(args.host, args.port, args.template, args.batch_size, args.max_wait_ms))
+    except KeyboardInterrupt:
+        pass
+
+def _positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return value
+
+def _non_negative_float(text):
+    value = float(text)
+    if value < 0:
+        raise argparse.ArgumentTypeError(f"must not be negative, got {value:g}")
+    return value
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="omr", description="OMR sheet scoring tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    score_parser = commands.add_parser("score", help="Score every sheet in a folder")
+    score_parser.add_argument("image_dir", help="Folder with sheet images, multi-page TIFFs or PDFs")
+    score_parser.add_argument("template", help="Coordinates file (.csv/.xlsx) or parametric _grid.csv")
+    score_parser.add_argument("--excel", action="store_true", help="Write OMR_Report.xlsx (needs openpyxl) instead of OMR_Report.csv")
+    score_parser.add_argument("--pdf-dpi", type=float, help="Render PDF pages at this dpi instead of their embedded scan's resolution")
+    score_parser.set_defaults(handler=score)
+
+    detect_parser = commands.add_parser("detect-markers", help="Highlight corner registration markers on a sheet")
+    detect_parser.add_argument("image", help="Sheet image")
+    detect_parser.add_argument("output", help="Where to save the annotated image")
+    detect_parser.set_defaults(handler=detect_markers)
+
+    compile_parser = commands.add_parser("compile-template", help="Convert a flat coordinates file to a parametric grid file")
+    compile_parser.add_argument("coordinates", help="Flat Group,Question,Option,X,Y file (.csv/.xlsx)")
+    compile_parser.add_argument("output", help="Grid file to write")
+    compile_parser.set_defaults(handler=compile_template)
+
+    serve_parser = commands.add_parser("serve", help="Run a local HTTP scoring service")
+    serve_parser.add_argument("--template", help="Default template for requests that do not name one")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: localhost only)")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--batch-size", type=_positive_int, default=8, help="Most sheets scored together in one batch")
+    serve_parser.add_argument("--max-wait-ms", type=_non_negative_float, default=5, help="Longest a forming batch waits to fill; a lone request is scored at once")
+    serve_parser.set_defaults(handler=serve)
+
+    gui_parser = commands.add_parser("gui", help="Open the template marking and review GUI")
+    gui_parser.set_defaults(handler=gui)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
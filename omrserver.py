@@ -0,0 +1,261 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+
+import cv2
+import numpy as np
+
+from Markinomr import MULTIPAGE_EXTENSIONS, PageBuffers, load_template, read_page, score_pages, sheet_confidence, threshold_page
+
+MAX_UPLOAD_BYTES = 64 * 2**20  # Largest image body accepted on /score
+LATENCY_WINDOW = 10000  # Most recent requests used for the p50/p99 figures
+STATS_REPORT_EVERY = 100  # Requests between latency reports on the console
+MAX_TEMPLATES = 16  # Compiled templates kept in memory; the least recently used is dropped first
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error"}
+
+def sheet_result(image_name, page, image_results):
+    """Turn score_page rows into the per-question JSON returned by /score."""
+    questions = {}
+    for _, _, question, option, fill_percentage, marked_status, duplicate, _ in image_results:
+        entry = questions.setdefault(str(question), {"marked": [], "duplicate": duplicate == "Duplicate", "fills": {}})
+        entry["fills"][str(option)] = round(fill_percentage, 2)
+        if marked_status == "Marked":
+            entry["marked"].append(str(option))
+    confidence, reasons = sheet_confidence(image_results)
+    return {"image": image_name, "page": page, "confidence": round(confidence, 3), "reasons": reasons, "questions": questions}
+
+def _percentile(values, percent):
+    return float(np.percentile(values, percent)) if values else None
+
+class ScoringService:
+    """Keeps compiled templates in memory and scores queued sheets in small batches.
+
+    A request that finds the queue empty is scored straight away. When others are
+    already waiting, up to batch_size of them are taken together, waiting at most
+    max_wait_ms for the batch to fill. Each batch is decoded on one worker thread,
+    its same-sized pages are thresholded into a reused (N, height, width) stack,
+    and every template block is reduced across the whole stack in one pass, so
+    the event loop stays free to accept uploads meanwhile.
+    """
+
+    def __init__(self, default_template=None, batch_size=8, max_wait_ms=5):
+        self.default_template = default_template
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.templates = OrderedDict()  # Template path -> (mtime, compiled blocks), only touched by the worker thread
+        self.buffers = PageBuffers()
+        self.stacks = {}  # Page shape -> (batch_size, height, width) threshold stack, reused across batches
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue = asyncio.Queue()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.batches = 0
+        self.batched_sheets = 0
+
+    def _template(self, path):
+        # Recompile when the file changes on disk so an edited template is picked up without a restart
+        mtime = os.stat(path).st_mtime
+        cached = self.templates.get(path)
+        if cached is not None and cached[0] == mtime:
+            self.templates.move_to_end(path)
+            return cached[1]
+        self.templates[path] = (mtime, load_template(path))
+        self.templates.move_to_end(path)
+        while len(self.templates) > MAX_TEMPLATES:
+            self.templates.popitem(last=False)
+        return self.templates[path][1]
+
+    def _load(self, job):
+        if job.get("data") is not None:
+            return cv2.imdecode(np.frombuffer(job["data"], dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        path, page = job["path"], job["page"]
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No such image: {path}")
+        if page == 1 and not path.lower().endswith(MULTIPAGE_EXTENSIONS):
+            return self.buffers.decode(path)
+        return read_page(path, page)
+
+    def _score_batch(self, jobs):
+        # Runs on the worker thread; one failing sheet must not fail the rest of the batch
+        outcomes = [None] * len(jobs)
+        stacks = {}
+        groups = {}  # (template path, page shape) -> [(job index, stack slot)]
+        for index, job in enumerate(jobs):
+            try:
+                self._template(job["template"])
+                image = self._load(job)
+                if image is None:
+                    raise ValueError(f"{job['name']} has no page {job['page']} or it could not be decoded")
+            except Exception as error:
+                outcomes[index] = error
+                continue
+            # Threshold straight into the stack: decoding reuses one buffer for every job
+            if image.shape not in stacks:
+                stack = self.stacks.get(image.shape)
+                stacks[image.shape] = [stack if stack is not None else np.empty((self.batch_size,) + image.shape, dtype=np.uint8), 0]
+            entry = stacks[image.shape]
+            threshold_page(image, entry[0][entry[1]])
+            groups.setdefault((job["template"], image.shape), []).append((index, entry[1]))
+            entry[1] += 1
+        self.stacks = {shape: entry[0] for shape, entry in stacks.items()}
+
+        for (template_path, shape), members in groups.items():
+            slots = [slot for _, slot in members]
+            stack = self.stacks[shape]
+            pages = stack[slots[0]:slots[-1] + 1] if slots == list(range(slots[0], slots[-1] + 1)) else stack[slots]
+            try:
+                results = score_pages(pages, self._template(template_path), [(jobs[i]["name"], jobs[i]["page"]) for i, _ in members])
+                for (index, _), image_results in zip(members, results):
+                    outcomes[index] = sheet_result(jobs[index]["name"], jobs[index]["page"], image_results)
+            except Exception as error:
+                for index, _ in members:
+                    outcomes[index] = error
+        return outcomes
+
+    async def batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            # A lone request is dispatched at once; only a batch that is already
+            # forming waits, up to max_wait, for more sheets to join it
+            deadline = loop.time() + self.max_wait
+            while 1 < len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                outcomes = await loop.run_in_executor(self.executor, self._score_batch, [job for job, _ in batch])
+            except Exception as error:
+                # Fail this batch's requests rather than the batcher, which would leave every later request hanging
+                print(f"Scoring batch of {len(batch)} failed: {error}")
+                outcomes = [error] * len(batch)
+            self.batches += 1
+            self.batched_sheets += len(batch)
+            for (_, future), outcome in zip(batch, outcomes):
+                if future.cancelled():
+                    continue
+                if isinstance(outcome, Exception):
+                    future.set_exception(outcome)
+                else:
+                    future.set_result(outcome)
+
+    async def score(self, job):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((job, future))
+        return await future
+
+    def stats(self):
+        latencies = list(self.latencies)
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": round(self.batched_sheets / self.batches, 2) if self.batches else None,
+            "p50_ms": _percentile(latencies, 50),
+            "p99_ms": _percentile(latencies, 99),
+            "templates_loaded": len(self.templates),
+        }
+
+    def record_latency(self, started):
+        self.latencies.append((time.perf_counter() - started) * 1000)
+        self.requests += 1
+        if self.requests % STATS_REPORT_EVERY == 0:
+            stats = self.stats()
+            print(f"{stats['requests']} requests, p50 {stats['p50_ms']:.1f} ms, p99 {stats['p99_ms']:.1f} ms, mean batch {stats['mean_batch_size']}")
+
+    async def route(self, method, url, headers, body):
+        path, query = url.path, parse_qs(url.query)
+        if path == "/stats":
+            return 200, self.stats()
+        if path != "/score":
+            return 404, {"error": f"Unknown endpoint {path}"}
+        if method != "POST":
+            return 405, {"error": "Use POST to score a sheet"}
+
+        # Either a JSON body naming an image on disk, or the raw image bytes
+        if headers.get("content-type", "").startswith("application/json"):
+            request = json.loads(body or b"{}")
+            if "path" not in request:
+                return 400, {"error": "JSON requests need an image 'path'"}
+            page = request.get("page", 1)
+            if isinstance(page, bool) or not isinstance(page, int) or page < 1:
+                return 422, {"error": f"'page' must be a whole number from 1, got {page!r}"}
+            job = {"path": request["path"], "page": page, "name": os.path.basename(request["path"])}
+            template = request.get("template")
+        else:
+            if not body:
+                return 400, {"error": "Send the image as the request body or a JSON 'path'"}
+            job = {"data": body, "page": 1, "name": query.get("name", ["upload"])[0]}
+            template = None
+        job["template"] = template or query.get("template", [self.default_template])[0]
+        if not job["template"]:
+            return 400, {"error": "No template given and the server has no default template"}
+
+        try:
+            return 200, await self.score(job)
+        except FileNotFoundError as error:
+            return 404, {"error": str(error)}
+        except ValueError as error:
+            return 422, {"error": str(error)}
+
+    async def handle(self, reader, writer):
+        started = time.perf_counter()
+        path = None
+        try:
+            method, target, _ = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, value = line.decode("latin-1").split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if length > MAX_UPLOAD_BYTES:
+                status, payload = 413, {"error": f"Uploads are limited to {MAX_UPLOAD_BYTES} bytes"}
+            else:
+                body = await reader.readexactly(length) if length else b""
+                url = urlparse(target)
+                path = url.path
+                status, payload = await self.route(method, url, headers, body)
+        except (ValueError, asyncio.IncompleteReadError) as error:
+            status, payload = 400, {"error": f"Malformed request: {error}"}
+        except Exception as error:
+            status, payload = 500, {"error": f"Scoring failed: {error}"}
+
+        content = json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(content)}\r\nConnection: close\r\n\r\n".encode() + content
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+        if path == "/score" and status == 200:
+            self.record_latency(started)
+
+async def serve(host="127.0.0.1", port=8765, template=None, batch_size=8, max_wait_ms=5):
+    service = ScoringService(template, batch_size, max_wait_ms)
+    if template:
+        # Compile the default template up front so the first request does not pay for it
+        await asyncio.get_running_loop().run_in_executor(service.executor, service._template, template)
+    batcher = asyncio.create_task(service.batch_loop())
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"Scoring service listening on http://{host}:{port} (batch size {batch_size}, max wait {max_wait_ms} ms)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batcher.cancel()
+        service.executor.shutdown(wait=False)
+        print(f"Final latency stats: {service.stats()}")